@@ -22,31 +22,110 @@ import io
 import os
 import sys
 import ssl
-import glob
 import shutil
 import struct
+import hashlib
 import tempfile
-import contextlib
 import subprocess
 import datetime as dt
 from zipfile import ZipFile
 try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+try:
+    from urllib.error import HTTPError
+    from urllib.request import Request
     from urllib.request import urlopen
 except ImportError:
+    from urllib2 import HTTPError
+    from urllib2 import Request
     from urllib2 import urlopen
+if os.environ.get("GEOSLIBRARY_FAST_ZLIB"):
+    # Opt-in replacement of the `zlib` backend used by `zipfile`.
+    try:
+        import zipfile
+        from isal import isal_zlib
+        zipfile.zlib = isal_zlib
+    except ImportError:
+        pass
 
 
 URL_DATETIME_FMT = "%a, %d %b %Y %H:%M:%S GMT"
 GEOS_BASEURL = "https://github.com/libgeos/geos/archive/refs/tags"
 
+_COPY_BUF = 128 * 1024
+_LARGE_ZIP_MINSIZE = 1024 * 1024
+_INMEMORY_MAXSIZE = 50 * 1024 * 1024
+_SSL_CONTEXT = None
+
+
+def _ssl_context():
+    """Return the SSL context shared by all the HTTP requests."""
+
+    global _SSL_CONTEXT
+    if _SSL_CONTEXT is None:
+        _SSL_CONTEXT = ssl.create_default_context()
+    return _SSL_CONTEXT
+
+
+def _parse_http_date(text):
+    """Convert an HTTP header date into a POSIX timestamp."""
+
+    if text is None:
+        return None
+    date = dt.datetime.strptime(text, URL_DATETIME_FMT)
+    date = date.replace(tzinfo=dt.timezone.utc)
+    return date.timestamp()
+
+
+def _format_http_date(timestamp):
+    """Convert a POSIX timestamp into an HTTP header date."""
+
+    date = dt.datetime.fromtimestamp(timestamp, dt.timezone.utc)
+    return date.strftime(URL_DATETIME_FMT)
+
+
+def _cpu_count():
+    """Return the number of CPUs available to the current process."""
+
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _member_path(root, name):
+    """Return the destination path of a zip file member in a folder."""
+
+    # Drop empty, relative and absolute components as `zipfile` does.
+    parts = [part for part in name.split("/") if part not in ("", ".", "..")]
+    return os.path.join(root, *parts)
+
+
+def _extract_members(zipsrc, members, root):
+    """Decompress a subset of zip file members into a folder."""
+
+    if isinstance(zipsrc, bytes):
+        zipsrc = io.BytesIO(zipsrc)
+    with ZipFile(zipsrc, "r") as fd:
+        for info in members:
+            target = _member_path(root, info.filename)
+            with fd.open(info) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, length=_COPY_BUF)
+
 
 class GeosLibrary(object):
     """Helper class to download, build and install GEOS."""
 
+    _cmake_version = None
+
     def __init__(self, version, root=None):
         """Initialise a new :class:`GeosLibrary` instance."""
 
         self.version_tuple = tuple(map(int, version.split(".")))
+        self.version = ".".join(map(str, self.version_tuple))
+        self._zipname = "geos-{0}.zip".format(self.version)
+        self._zipfold_name = "geos-{0}".format(self.version)
 
         if root is None:
             self.temp = True
@@ -68,157 +147,388 @@ class GeosLibrary(object):
             except OSError:
                 pass
 
-    @property
-    def version(self):
-        """GEOS library version in string format."""
-
-        return ".".join(map(str, self.version_tuple))
+    @classmethod
+    def cmake_version(cls):
+        """Installed CMake version in tuple format (cached)."""
 
-    def download(self):
-        """Download GEOS zip source code into :class:`GeosLibrary` root."""
+        if cls._cmake_version is None:
+            try:
+                output = subprocess.check_output(["cmake", "--version"])
+                words = output.decode("utf-8", "replace").split()
+                text = words[words.index("version") + 1].split("-")[0]
+                cls._cmake_version = tuple(map(int, text.split(".")[:3]))
+            except (OSError, subprocess.CalledProcessError, ValueError,
+                    IndexError):
+                cls._cmake_version = ()
+        return cls._cmake_version
+
+    def _urlopen(self, headers=None):
+        """Open the HTTP connection to the GEOS zip source code."""
 
         # Define download link.
         link = "{0}/{1}.zip".format(GEOS_BASEURL, self.version)
-        suffix = os.path.splitext(link)[-1]
-
-        # Define output path.
-        zipname = "geos-{0}".format(link.rsplit("/", 1)[-1])
-        zippath = os.path.join(self.root, zipname)
+        request = Request(link, headers=headers or {})
 
         # Handle creation of the HTTP request.
-        kwargs = {}
-        if hasattr(ssl, "SSLContext") and hasattr(ssl, "PROTOCOL_TLSv1_2"):
-            kwargs.update(context=ssl.SSLContext(ssl.PROTOCOL_TLSv1_2))
+        return urlopen(request, context=_ssl_context())
+
+    def download(self):
+        """Download GEOS zip source code into :class:`GeosLibrary` root."""
+
+        # Define output path.
+        zippath = os.path.join(self.root, self._zipname)
+        etagpath = "{0}.etag".format(zippath)
+
+        # Only request the file if it changed since the previous download.
+        headers = {}
+        if os.path.exists(zippath):
+            stamp = os.path.getmtime(zippath)
+            headers["If-Modified-Since"] = _format_http_date(stamp)
+            if os.path.exists(etagpath):
+                with io.open(etagpath, "r", encoding="utf-8") as fd:
+                    headers["If-None-Match"] = fd.read().strip()
         try:
-            conn = urlopen(link, **kwargs)
-        except TypeError:
-            # Fallback if `urlopen` does not accept context.
-            conn = urlopen(link)
-
-        with contextlib.closing(conn):
-            # Try to get the file timestamp from the HTTP request header.
-            date = conn.headers.get("Last-Modified")
-            if date is not None:
-                date = dt.datetime.strptime(date, URL_DATETIME_FMT)
-                date = date.replace(tzinfo=dt.timezone.utc)
-                date = date.timestamp()
-            with tempfile.NamedTemporaryFile(suffix=suffix) as tmpzipobj:
-                # Copy the buffer into a temporary file.
-                shutil.copyfileobj(conn, tmpzipobj)
-                # Move the file descriptor pointer to the beginning and
-                # simply copy it to the final destination.
-                tmpzipobj.seek(0)
-                with open(zippath, "wb") as zipobj:
-                    shutil.copyfileobj(tmpzipobj, zipobj)
-            # Assign the timestamps to the final file if available.
-            if date is not None:
-                os.utime(zippath, (date, date))
-
-    def extract(self, overwrite=True):
+            conn = self._urlopen(headers)
+        except HTTPError as err:
+            # The local zip file is still up to date.
+            if err.code == 304:
+                return
+            raise
+
+        with conn:
+            # Try to get the file timestamp and tag from the HTTP header.
+            etag = conn.headers.get("ETag")
+            date = _parse_http_date(conn.headers.get("Last-Modified"))
+            # Stream the buffer into a sibling partial file and move it to
+            # the final destination only once the download is complete.
+            partpath = "{0}.part".format(zippath)
+            try:
+                with open(partpath, "wb", buffering=1024 * 1024) as zipobj:
+                    shutil.copyfileobj(conn, zipobj, length=_COPY_BUF)
+            except BaseException:
+                try:
+                    os.remove(partpath)
+                except OSError:
+                    pass
+                raise
+        os.replace(partpath, zippath)
+        # Assign the timestamps to the final file if available.
+        if date is not None:
+            os.utime(zippath, (date, date))
+        # Store the entity tag for the next conditional requests.
+        if etag is not None:
+            with io.open(etagpath, "wb") as fd:
+                fd.write(etag.encode())
+        elif os.path.exists(etagpath):
+            os.remove(etagpath)
+
+    def _get_stamp(self, kind="mtime"):
+        """Return the zip file timestamp or tag used for the last extraction."""
+
+        zipfold = os.path.join(self.root, self._zipfold_name)
+        stamp = os.path.join(zipfold, ".extracted_from_{0}".format(kind))
+        if not os.path.exists(stamp):
+            return None
+        with io.open(stamp, "r", encoding="utf-8") as fd:
+            return fd.read().strip()
+
+    def _set_stamp(self, value, kind="mtime"):
+        """Record the zip file timestamp or tag used for the last extraction."""
+
+        zipfold = os.path.join(self.root, self._zipfold_name)
+        stamp = os.path.join(zipfold, ".extracted_from_{0}".format(kind))
+        with io.open(stamp, "wb") as fd:
+            fd.write(value.encode())
+
+    def extract(self, overwrite=True, force=False):
         """Decompress GEOS zip source code into :class:`GeosLibrary` root."""
 
+        self._extract(overwrite=overwrite, force=force)
+        self._patch_sources()
+
+    def extract_in_memory(self, overwrite=True, force=False):
+        """Download and decompress GEOS zip source code without storing it."""
+
+        self._extract_in_memory(overwrite=overwrite, force=force)
+        self._patch_sources()
+
+    def _extract(self, overwrite=True, force=False):
+        """Decompress GEOS zip source code and patch its CMake files."""
+
         # Download zip file if not present.
-        zippath = os.path.join(self.root, "geos-{0}.zip".format(self.version))
+        zippath = os.path.join(self.root, self._zipname)
         if not os.path.exists(zippath):
             self.download()
 
+        # Skip extraction if the folder comes from the same zip file.
+        zipmtime = "{0!r}".format(os.path.getmtime(zippath))
+        if not force and self._get_stamp() == zipmtime:
+            return
+
+        self._unzip(zippath, overwrite=overwrite)
+        self._postprocess()
+
+        # Record the zip file used so that next calls can skip extraction.
+        self._set_stamp(zipmtime)
+
+    def _extract_in_memory(self, overwrite=True, force=False):
+        """Decompress GEOS zip source code from memory and patch it."""
+
+        # Only request the file if it changed since the last extraction.
+        headers = {}
+        zipmtime = self._get_stamp()
+        zipetag = self._get_stamp(kind="etag")
+        if not force and zipmtime is not None:
+            headers["If-Modified-Since"] = _format_http_date(float(zipmtime))
+        if not force and zipetag is not None:
+            headers["If-None-Match"] = zipetag
+        try:
+            conn = self._urlopen(headers)
+        except HTTPError as err:
+            # The extracted source code is still up to date.
+            if err.code == 304:
+                return
+            raise
+
+        with conn:
+            etag = conn.headers.get("ETag")
+            date = _parse_http_date(conn.headers.get("Last-Modified"))
+            size = conn.headers.get("Content-Length")
+            if size is not None and int(size) > _INMEMORY_MAXSIZE:
+                zipdata = None
+            else:
+                # Copy the buffer into memory.
+                zipobj = io.BytesIO()
+                shutil.copyfileobj(conn, zipobj, length=_COPY_BUF)
+                zipdata = zipobj.getvalue()
+
+        # Keep large zip files on disk.
+        if zipdata is None:
+            self._extract(overwrite=overwrite, force=force)
+            return
+
+        # Skip extraction if the folder comes from the same zip file.
+        if date is not None:
+            date = "{0!r}".format(date)
+        if not force:
+            if date is not None and zipmtime == date:
+                return
+            if etag is not None and zipetag == etag:
+                return
+
+        self._unzip(zipdata, overwrite=overwrite)
+        self._postprocess()
+
+        # Record the zip file used so that next calls can skip extraction.
+        if date is not None:
+            self._set_stamp(date)
+        if etag is not None:
+            self._set_stamp(etag, kind="etag")
+
+    def _unzip(self, zipsrc, overwrite=True):
+        """Decompress GEOS zip source code from a path or from bytes."""
+
         # Remove destination folder if present and requested.
-        zipfold = os.path.join(self.root, "geos-{0}".format(self.version))
+        zipfold = os.path.join(self.root, self._zipfold_name)
         if os.path.exists(zipfold):
             if not overwrite:
                 raise OSError("folder '{0}' already exists".format(zipfold))
             shutil.rmtree(zipfold)
 
-        # Decompress zip file.
-        with contextlib.closing(ZipFile(zippath, "r")) as fd:
-            fd.extractall(self.root)
+        inmemory = isinstance(zipsrc, bytes)
+        if inmemory:
+            zipsize = len(zipsrc)
+            zipobj = io.BytesIO(zipsrc)
+        else:
+            zipsize = os.path.getsize(zipsrc)
+            zipobj = zipsrc
+
+        # Use a native tool for large files if available and not disabled.
+        if (zipsize >= _LARGE_ZIP_MINSIZE and
+                not os.environ.get("GEOSLIBRARY_PURE_PYTHON")):
+            bsdtar = shutil.which("bsdtar")
+            unzip = shutil.which("unzip")
+            if bsdtar is not None:
+                if inmemory:
+                    subprocess.run([bsdtar, "-xf", "-", "-C", self.root],
+                                   input=zipsrc, check=True)
+                else:
+                    subprocess.run([bsdtar, "-xf", zipsrc, "-C", self.root],
+                                   check=True)
+                return
+            if unzip is not None and not inmemory:
+                subprocess.run([unzip, "-q", "-o", zipsrc, "-d", self.root],
+                               check=True)
+                return
+
+        # Create all the folders first and then decompress the zip file
+        # member by member, using several threads for large files.
+        with ZipFile(zipobj, "r") as fd:
+            infolist = fd.infolist()
+        folders = set()
+        members = []
+        for info in infolist:
+            target = _member_path(self.root, info.filename)
+            if info.filename.endswith("/"):
+                folders.add(target)
+            else:
+                folders.add(os.path.dirname(target))
+                members.append(info)
+        for folder in sorted(folders):
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+        if zipsize < _LARGE_ZIP_MINSIZE or ThreadPoolExecutor is None:
+            _extract_members(zipsrc, members, self.root)
+        elif members:
+            nworkers = min(_cpu_count(), len(members))
+            with ThreadPoolExecutor(max_workers=nworkers) as executor:
+                futures = [
+                    executor.submit(_extract_members, zipsrc,
+                                    members[i::nworkers], self.root)
+                    for i in range(nworkers)
+                ]
+                for future in futures:
+                    future.result()
+
+    def _postprocess(self):
+        """Apply the patches required before configuring GEOS."""
+
+        zipfold = os.path.join(self.root, self._zipfold_name)
 
         # Ensure that GEOS internal sh scripts can be executed.
-        for path in sorted(glob.glob(os.path.join(zipfold, "tools", "*.sh"))):
-            os.chmod(path, 0o755)
+        tools = os.path.join(zipfold, "tools")
+        if os.path.isdir(tools):
+            with os.scandir(tools) as it:
+                for entry in it:
+                    if entry.name.endswith(".sh") and entry.is_file():
+                        os.chmod(entry.path, 0o755)
 
         # Apply specific patches for GEOS < 3.6.0.
         if self.version_tuple < (3, 6, 0):
-            # The SVN revision file is not created on the fly before 3.6.0.
-            svn_hfile = os.path.join(zipfold, "geos_svn_revision.h")
-            if not os.path.exists(svn_hfile):
-                with io.open(svn_hfile, "wb") as fd:
-                    text = "#define GEOS_SVN_REVISION 0"
-                    fd.write(text.encode())
             # Reduce warnings when compiling with `nmake` on Windows.
             cmakefile = os.path.join(zipfold, "CMakeLists.txt")
             if os.path.exists(cmakefile):
-                with io.open(cmakefile, "r", encoding="utf-8") as fd:
-                    lines = fd.readlines()
-                with io.open(cmakefile, "wb") as fd:
-                    oldtext = 'string(REGEX REPLACE "/W[0-9]" "/W4"'
-                    newtext = oldtext.replace("W4", "W1")
-                    for line in lines:
-                        fd.write(line.replace(oldtext, newtext).encode())
+                with io.open(cmakefile, "rb") as fd:
+                    data = fd.read().replace(b"\r\n", b"\n")
+                oldtext = b'string(REGEX REPLACE "/W[0-9]" "/W4"'
+                newtext = oldtext.replace(b"W4", b"W1")
+                if oldtext in data:
+                    with io.open(cmakefile, "wb") as fd:
+                        fd.write(data.replace(oldtext, newtext))
 
         # Apply specific patches for 3.6.0 <= GEOS < 3.7.0 on Windows.
         if (3, 6, 0) <= self.version_tuple < (3, 7, 0) and os.name == "nt":
             autogen_file = os.path.join(zipfold, "autogen.bat")
-            subprocess.call([autogen_file], cwd=zipfold)
-            cppfile = os.path.join(zipfold, "src", "geomgraph", "DirectedEdgeStar.cpp")
-            with io.open(cppfile, "r", encoding="utf-8") as fd:
-                lines = fd.readlines()
-            with io.open(cppfile, "wb") as fd:
-                oldtext = "DirectedEdgeStar::print() const"
-                newtext = oldtext.replace(" const", "")
-                for line in lines:
-                    fd.write(line.replace(oldtext, newtext).encode())
-            hfile = os.path.join(zipfold, "include", "geos", "geomgraph", "DirectedEdgeStar.h")
-            with io.open(hfile, "r", encoding="utf-8") as fd:
-                lines = fd.readlines()
-            with io.open(hfile, "wb") as fd:
-                oldtext = "virtual std::string print() const;"
-                newtext = oldtext.replace(" const", "")
-                for line in lines:
-                    fd.write(line.replace(oldtext, newtext).encode())
+            subprocess.run([autogen_file], cwd=zipfold, check=True)
 
         # Patch CMakeLists to link shared geos_c with static geos.
         if self.version_tuple < (3, 8, 0):
             cmakefile = os.path.join(zipfold, "capi", "CMakeLists.txt")
-            oldtext = "target_link_libraries(geos_c geos)"
-            newtext = "target_link_libraries(geos_c geos-static)"
+            oldtext = b"target_link_libraries(geos_c geos)"
+            newtext = b"target_link_libraries(geos_c geos-static)"
         else:
             cmakefile = os.path.join(zipfold, "CMakeLists.txt")
-            oldtext = 'add_library(geos "")'
-            newtext = 'add_library(geos STATIC "")'
-        with io.open(cmakefile, "r", encoding="utf-8") as fd:
-            lines = fd.readlines()
-        with io.open(cmakefile, "wb") as fd:
-            found_sharedline = False
-            shared_oldtext = "if(BUILD_SHARED_LIBS)"
-            shared_newtext = "if(FALSE)"
-            for line in lines:
-                if not found_sharedline and shared_oldtext in line:
-                    line = line.replace(shared_oldtext, shared_newtext)
-                    found_sharedline = True
-                fd.write(line.replace(oldtext, newtext).encode())
+            oldtext = b'add_library(geos "")'
+            newtext = b'add_library(geos STATIC "")'
+        with io.open(cmakefile, "rb") as fd:
+            data = fd.read().replace(b"\r\n", b"\n")
+        # Skip the patch if the file was already patched.
+        if newtext not in data:
+            # Only the first shared library switch has to be disabled.
+            shared_oldtext = b"if(BUILD_SHARED_LIBS)"
+            shared_newtext = b"if(FALSE)"
+            data = data.replace(shared_oldtext, shared_newtext, 1)
+            with io.open(cmakefile, "wb") as fd:
+                fd.write(data.replace(oldtext, newtext))
 
         # Patch doc CMakeLists in GEOS 3.8.x series.
         if (3, 8, 0) <= self.version_tuple < (3, 9, 0):
             cmakefile = os.path.join(zipfold, "doc", "CMakeLists.txt")
-            oldtext1 = "target_include_directories(test_geos_unit\n"
-            newtext1 = "if(BUILD_TESTING)\n    {0}".format(oldtext1)
-            oldtext2 = "$<BUILD_INTERFACE:${CMAKE_CURRENT_LIST_DIR}>)\n"
-            newtext2 = "{0}endif()\n".format(oldtext2)
-            with io.open(cmakefile, "r", encoding="utf-8") as fd:
-                lines = fd.readlines()
-            with io.open(cmakefile, "wb") as fd:
-                for line in lines:
-                    line = line.replace(oldtext1, newtext1)
-                    line = line.replace(oldtext2, newtext2)
-                    fd.write(line.encode())
+            oldtext1 = b"target_include_directories(test_geos_unit\n"
+            newtext1 = b"if(BUILD_TESTING)\n    " + oldtext1
+            oldtext2 = b"$<BUILD_INTERFACE:${CMAKE_CURRENT_LIST_DIR}>)\n"
+            newtext2 = oldtext2 + b"endif()\n"
+            with io.open(cmakefile, "rb") as fd:
+                data = fd.read().replace(b"\r\n", b"\n")
+            # Skip the patch if the file was already patched.
+            if newtext1 not in data:
+                data = data.replace(oldtext1, newtext1)
+                data = data.replace(oldtext2, newtext2)
+                with io.open(cmakefile, "wb") as fd:
+                    fd.write(data)
+
+    def _patch_sources(self):
+        """Apply the patches to GEOS files only read when compiling."""
+
+        zipfold = os.path.join(self.root, self._zipfold_name)
 
-    def build(self, installdir=None, toolset=None, njobs=1):
+        # The SVN revision file is not created on the fly before 3.6.0.
+        if self.version_tuple < (3, 6, 0):
+            svn_hfile = os.path.join(zipfold, "geos_svn_revision.h")
+            if not os.path.exists(svn_hfile):
+                with io.open(svn_hfile, "wb") as fd:
+                    text = "#define GEOS_SVN_REVISION 0"
+                    fd.write(text.encode())
+
+        # Apply specific patches for 3.6.0 <= GEOS < 3.7.0 on Windows.
+        if (3, 6, 0) <= self.version_tuple < (3, 7, 0) and os.name == "nt":
+            cppfile = os.path.join(zipfold, "src", "geomgraph", "DirectedEdgeStar.cpp")
+            hfile = os.path.join(zipfold, "include", "geos", "geomgraph", "DirectedEdgeStar.h")
+            for path, oldtext in [
+                    (cppfile, b"DirectedEdgeStar::print() const"),
+                    (hfile, b"virtual std::string print() const;")]:
+                with io.open(path, "rb") as fd:
+                    data = fd.read().replace(b"\r\n", b"\n")
+                newtext = oldtext.replace(b" const", b"")
+                if oldtext in data:
+                    with io.open(path, "wb") as fd:
+                        fd.write(data.replace(oldtext, newtext))
+
+    def _configure(self, builddir, config_opts):
+        """Call cmake configure unless already done with the same options."""
+
+        # The environment variables read by CMake also define the setup.
+        config_cmd = ["cmake", ".."] + config_opts
+        config_env = ["{0}={1}".format(key, os.environ.get(key, ""))
+                      for key in ("CC", "CXX", "CMAKE_GENERATOR")]
+        config_text = "\0".join(config_opts + config_env)
+        config_hash = hashlib.sha1(config_text.encode()).hexdigest()
+        config_hashfile = os.path.join(builddir, ".config_hash")
+        if os.path.exists(os.path.join(builddir, "CMakeCache.txt")):
+            if os.path.exists(config_hashfile):
+                with io.open(config_hashfile, "r", encoding="utf-8") as fd:
+                    if fd.read().strip() == config_hash:
+                        return
+
+        # Forget the previous options before CMake rewrites its cache, so
+        # that a failed configure is never mistaken for a successful one.
+        if os.path.exists(config_hashfile):
+            os.remove(config_hashfile)
+        print(" ".join(config_cmd))
+        subprocess.run(config_cmd, cwd=builddir, check=True)
+        with io.open(config_hashfile, "wb") as fd:
+            fd.write(config_hash.encode())
+
+    def build(self, installdir=None, toolset=None, njobs=None):
         """Build and install GEOS from source."""
 
-        # Download and extract zip file if not present.
-        zipfold = os.path.join(self.root, "geos-{0}".format(self.version))
-        self.extract(overwrite=True)
+        # Download and extract zip file if not present or outdated, in
+        # the background while the installed CMake version is probed.
+        # The zip file is only kept in memory if it is not on disk yet and
+        # the root folder is temporary, so that persistent roots keep it.
+        zippath = os.path.join(self.root, self._zipname)
+        zipfold = os.path.join(self.root, self._zipfold_name)
+        if os.path.exists(zippath) or not self.temp:
+            extract = self._extract
+        else:
+            extract = self._extract_in_memory
+        if ThreadPoolExecutor is None:
+            extract(overwrite=True)
+        else:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                extraction = executor.submit(extract, overwrite=True)
+                self.cmake_version()
+                extraction.result()
         version = self.version_tuple
 
         # Define build and install directory.
@@ -240,6 +550,13 @@ class GeosLibrary(object):
         ]
         build_env = os.environ.copy()
 
+        # Use all the available CPUs if the number of jobs is not given.
+        if njobs is None:
+            njobs = _cpu_count()
+
+        # Use the generator-agnostic parallel flag if CMake supports it.
+        parallel = self.cmake_version() >= (3, 12)
+
         # Define custom configure and build options.
         if os.name == "nt":
             win64 = (8 * struct.calcsize("P") == 64)
@@ -252,7 +569,8 @@ class GeosLibrary(object):
                     except (TypeError, ValueError):
                         msvc = toolset
                     config_opts += ["-DCMAKE_GENERATOR_TOOLSET={0}".format(msvc)]
-                build_opts = ["-j", "{0:d}".format(njobs)] + build_opts
+                build_opts = ["--parallel" if parallel else "-j",
+                              "{0:d}".format(njobs)] + build_opts
             else:
                 config_opts = ["-G", "NMake Makefiles"] + config_opts
                 build_opts.extend([
@@ -263,21 +581,55 @@ class GeosLibrary(object):
                 if sys.version_info[:2] < (3, 3):
                     build_opts += ["MSVC_VER=1500"]
         else:
-            build_env["MAKEFLAGS"] = "-j {0:d}".format(njobs)
+            if parallel:
+                build_opts = ["--parallel", "{0:d}".format(njobs)] + build_opts
+            else:
+                build_env["MAKEFLAGS"] = "-j {0:d}".format(njobs)
             if version >= (3, 7, 0):
                 config_opts += ["-DCMAKE_CXX_FLAGS='-fPIC'"]
 
+        # Use a compiler cache if available and not disabled.
+        if not os.environ.get("GEOSLIBRARY_NO_CCACHE"):
+            launcher = shutil.which("ccache") or shutil.which("sccache")
+            if launcher is not None:
+                config_opts += [
+                    "-DCMAKE_C_COMPILER_LAUNCHER={0}".format(launcher),
+                    "-DCMAKE_CXX_COMPILER_LAUNCHER={0}".format(launcher),
+                ]
+
+        # Prefer Ninja over Unix Makefiles unless the build directory was
+        # already configured with another generator. The Windows branches
+        # keep their Visual Studio and NMake generators.
+        if os.name != "nt" and shutil.which("ninja") is not None:
+            cachefile = os.path.join(builddir, "CMakeCache.txt")
+            if os.path.exists(cachefile):
+                with io.open(cachefile, "rb") as fd:
+                    use_ninja = b"CMAKE_GENERATOR:INTERNAL=Ninja\n" in fd.read()
+            else:
+                use_ninja = True
+            if use_ninja:
+                config_opts = ["-G", "Ninja"] + config_opts
+
         # Call cmake configure after ensuring that the build directory exists.
+        # The source files only needed when compiling are patched meanwhile.
         try:
             os.makedirs(builddir)
         except OSError:
             pass
-        subprocess.call(["cmake", ".."] + config_opts, cwd=builddir)
+        if ThreadPoolExecutor is None:
+            self._patch_sources()
+            self._configure(builddir, config_opts)
+        else:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                patching = executor.submit(self._patch_sources)
+                self._configure(builddir, config_opts)
+                patching.result()
 
         # Call cmake build after ensuring that the install directory exists.
         try:
             os.makedirs(installdir)
         except OSError:
             pass
-        subprocess.call(["cmake", "--build", "."] + build_opts,
-                        cwd=builddir, env=build_env)
+        build_cmd = ["cmake", "--build", "."] + build_opts
+        print(" ".join(build_cmd))
+        subprocess.run(build_cmd, cwd=builddir, env=build_env, check=True)